@@ -45,11 +45,18 @@ MSG_BURST = '5'
 #: steady state. To be safe, set this slightly higher than whatever the IRCd
 #: actually requires.
 MSG_RATE = '505'
+#: How many messages we will queue up while waiting to send them, e.g. because
+#: we are disconnected or sending as fast as MSG_RATE allows. Any more than
+#: this are dropped.
+MSG_MAX_QUEUE = '10000'
 #: Where the source code for this bot is hosted
 CODE_URL = 'https://gitlab.torproject.org/pastly/weechat-tormodbot'
 #: Where more information about the bot's anti-liberaham functionality can be
 #: found
 LIBERAHAM_URL = 'https://oftc.net/AntiSpamBot/'
+#: Whether to log debug messages, which can be very frequent (e.g. one per
+#: ignored message). See :meth:`tormodbot.dlog`.
+DEBUG = 'off'
 
 # ### liberaham.py configuration options ###
 #: Whether to enable the :mod:`tmb_mod.liberaham` module
@@ -66,7 +73,9 @@ conf = {
     'chanserv_userstr': CHANSERV_USERSTR,
     'msg_burst': MSG_BURST,
     'msg_rate': MSG_RATE,
+    'msg_max_queue': MSG_MAX_QUEUE,
     'code_url': CODE_URL,
     'liberaham_url': LIBERAHAM_URL,
+    'debug': DEBUG,
     'liberaham_enabled': LIBERAHAM_ENABLED,
 }
@@ -1,5 +1,5 @@
 #!/usr/bin/env bash
 
-FILES_W_PYTEST_UNIT_TESTS=( tmb_util/wordwrap.py tmb_util/lcsv.py )
+FILES_W_PYTEST_UNIT_TESTS=( tmb_util/wordwrap.py tmb_util/lcsv.py tmb_util/tokenbucket.py tmb_util/userstr.py tmb_util/spamtext.py )
 
 pytest -vv "${FILES_W_PYTEST_UNIT_TESTS[@]}"
@@ -73,7 +73,7 @@ class Module:
         You want to overwrite this function if you care about JOINs.
 
         :param UserStr user: Who JOINed.
-        :param str chan: The channel that was JOINed.
+        :param str chan: The channel that was JOINed, normalized to lowercase.
         '''
         pass
 
@@ -100,7 +100,8 @@ class Module:
 
         :param UserStr user: Who PRIVMSGed.
         :param str dest: The channel name (e.g. "#foo") in which the message
-            was seen, or our nick (if a literal PM to us).
+            was seen, or our nick (if a literal PM to us). Normalized to
+            lowercase.
         :param str message: The message sent, without leading or trailing
             whitespace.
         :param bool is_opmod: Whether or not this message is a statusmsg
@@ -39,7 +39,8 @@ import time
 import tormodbot as tmb
 # other modules/packages
 from tmb_util.msg import notice, voice, kline
-from tmb_util.userlist import user_in_chans
+from tmb_util.spamtext import kline_reason
+from tmb_util.userlist import chan_has_user
 from . import Module
 
 # To make calling weechat stuff take fewer characters
@@ -48,31 +49,43 @@ w = weechat
 #: Additional response to give when voicing a person and restating their
 #: message.
 EXTRA_RESPONSE = '(What\'s this? See {} )'.format(tmb.liberaham_url())
-#: List of (regex, reason) that will earn you an immediate k-line if seen
-REGEX_KLINE = [
-    (
-        re.compile(
-            'ǃ|ɑ|ɡ|ː|։|ഠ|፡|Ꭱ|Ꭲ|Ꭹ|Ꭻ|Ꮃ|Ꮇ|Ꮢ|Ꮤ|Ꮪ|Ꮯ|Ꮳ|Ꮴ|ᖇ|ᖴ|ᗷ|᛬|᜵|ᥒ|ᥙ|ᥱ|ᴠ|ᴡ|ỿ|․|'
-            '⁄|Ⅰ|Ⅽ|ⅰ|ⅴ|ⅹ|ⅼ|ⅽ|ⅾ|ⅿ|∕|∨|∪|⋁|⎼|⠆|⧸|ⲟ|ⲣ|Ⲥ|ⲭ|ⵑ|︓|﹕|﹗|．|／'),
-        'libera non-ascii spam'),
-    (re.compile('libera.*midipix', re.IGNORECASE), 'libera/midipix regex'),
-    (re.compile('imgur.*com', re.IGNORECASE), 'imgur.com link'),
-]
+#: Characters that only show up in the "libera hamradio" spam, which uses
+#: them as look-alikes for ASCII. See :meth:`has_spam_chars`.
+SPAM_CHARS = frozenset(
+    'ǃɑɡː։ഠ፡ᎡᎢᎩᎫᎳᎷᏒᏔᏚᏟᏣᏤᖇᖴᗷ᛬᜵ᥒᥙᥱᴠᴡỿ․'
+    '⁄ⅠⅭⅰⅴⅹⅼⅽⅾⅿ∕∨∪⋁⎼⠆⧸ⲟⲣⲤⲭⵑ︓﹕﹗．／')
+#: The reason to give when a message contains any of :data:`SPAM_CHARS`
+SPAM_CHARS_REASON = 'libera non-ascii spam'
 #: How often, in seconds, we will allow ourselves to also state the extra
 #: response. This is to make us less of a toy.
 EXTRA_RESPONSE_INTERVAL = 24 * 60 * 60
-#: The reason to give for the K-Line. Two parameters: the oper-only reason and
-#: the channel
+#: The reason to give for the K-Line. One parameter: the oper-only reason,
+#: which includes the channel
 KLINE_REASON = 'Suspected spammer. Mail support@oftc.net with questions'\
-    '|{} in {} !dronebl'
+    '|{} !dronebl'
 #: When redactding a URL, replace the URL with this.
 REDACTED_URL = '<REDACTED URL>'
 #: Regex that mataches on URL-looking things
-REGEX_URL = re.compile('https?://[^\s]+')  # noqa
+REGEX_URL = re.compile(r'https?://\S+')
+
+
+def has_spam_chars(in_str):
+    ''' Whether the given string contains any of :data:`SPAM_CHARS`. This is
+    a single pass over the string done entirely in C, with no regex engine
+    involved.
+
+    None of the spam characters are ASCII, and most messages are. CPython
+    remembers whether a str is pure ASCII, so ``isascii()`` answers without
+    looking at the characters and lets us skip the scan entirely. '''
+    return not in_str.isascii() and not SPAM_CHARS.isdisjoint(in_str)
 
 
 def censor_string(in_str):
     ''' Slightly censor a string to, e.g., not contain URLs '''
+    # Most messages have no URL at all, and a substring search is much
+    # cheaper than running the regex to find that out
+    if '://' not in in_str:
+        return in_str
     in_str = REGEX_URL.sub(REDACTED_URL, in_str)
     return in_str
 
@@ -82,43 +95,49 @@ class LiberaHamModule(Module):
     NAME = 'liberaham'
 
     def __init__(self):
-        #: The last time we gave the extra response.
-        self.last_extra_resp_ts = 0
-        pass
+        #: The earliest :meth:`time.monotonic` time at which we may give the
+        #: extra response again.
+        self.next_extra_resp_ts = 0
+
+    def _kline(self, user, receiver, reason):
+        ''' K-Line the host of :class:`tmb_util.userstr.UserStr` *user* for
+        spamming in channel *receiver*, giving *reason* to the opers. '''
+        reason_for_log = reason + ' in ' + receiver
+        mask = '*@' + user.host
+        tmb.log('kline {} ({}) for {}', mask, user.nick, reason_for_log)
+        kline(mask, KLINE_REASON.format(reason_for_log))
 
     def privmsg_cb(self, user, receiver, message, is_opmod):
         ''' Main tormodbot code calls into this when we're enabled and the
         given :class:`tmb_util.userstr.UserStr` has sent ``message`` (``str``)
         to ``recevier`` (``str``). The receiver can be a channel ("#foo") or a
         nick ("foo").  '''
-        # The first two are sanity checks: that the receiver is a non-empty
-        # string and that it looks like a channel name.
-        # The third check is that it is one of our moderated channels. We only
-        # care about those.
-        receiver = receiver.lower()
-        if not len(receiver) or \
-                receiver[0] != '#' or \
-                receiver not in tmb.mod_chans():
-            return
-        # Not a message from a muted user going to @#chan, so return
+        # Not a message from a muted user going to @#chan, so return. This is
+        # checked first because it is the cheapest check and it rejects
+        # nearly every message we see.
         if not is_opmod:
             return
+        # We only care about our moderated channels. tormodbot.py already
+        # lowercased the receiver, so this one set lookup also covers the
+        # empty string and nicks (PMs to us).
+        if receiver not in tmb.mod_chans_set():
+            return
         # User isn't in the channel, so return. With +z, messages from users
         # not in the channel go to chanops like us.
-        if receiver not in user_in_chans(user):
+        if not chan_has_user(receiver, user):
             return
         # It is indeed spam, so don't voice
-        for regex, reason in REGEX_KLINE:
-            if regex.search(message):
-                reason_for_log = '{} in {}'.format(reason, receiver)
-                mask = '*@' + user.host
-                tmb.log('kline {} ({}) for {}'.format(
-                    mask, user.nick, reason_for_log))
-                kline(mask, KLINE_REASON.format(reason, receiver))
-                return
+        if has_spam_chars(message):
+            self._kline(user, receiver, SPAM_CHARS_REASON)
+            return
+        reason = kline_reason(message)
+        if reason is not None:
+            self._kline(user, receiver, reason)
+            return
         voice(receiver, user.nick)
         notice(receiver, '{} said: {}', user.nick, censor_string(message))
-        if time.time() - self.last_extra_resp_ts > EXTRA_RESPONSE_INTERVAL:
+        now = time.monotonic()
+        if now > self.next_extra_resp_ts:
             notice(receiver, EXTRA_RESPONSE)
-            self.last_extra_resp_ts = time.time()
+            self.next_extra_resp_ts = now + EXTRA_RESPONSE_INTERVAL
         return
@@ -5,7 +5,7 @@ Additionally we provide a way to temporarily quick/akick.
 '''
 import weechat
 # stdlib imports
-from argparse import ArgumentParser
+from argparse import ArgumentParser, Namespace
 import os
 import sqlite3
 import time
@@ -13,17 +13,23 @@ import time
 import tormodbot as tmb
 # other modules/packages
 from tmb_util import userlist
-from tmb_util.lcsv import lcsv
+from tmb_util.lcsv import lcsv_parse
 from tmb_util.msg import msg
 
 # To make calling weechat stuff take fewer characters
 w = weechat
-#: All valid n!u@h patterns on which we can act
-ALL_PATTERNS = {
-    '*nick', 'nick', 'nick*', '*nick*',
-    '*user', 'user', 'user*', '*user*',
-    '*host', 'host', 'host*', '*host*',
+#: Map from each valid n!u@h pattern on which we can act to its "glob string"
+#: for chanserv. See :meth:`_pattern_to_glob_string`.
+PATTERN_GLOBS = {
+    'nick': '{}!*@*', 'nick*': '{}*!*@*',
+    '*nick': '*{}!*@*', '*nick*': '*{}*!*@*',
+    'user': '*!{}@*', 'user*': '*!{}*@*',
+    '*user': '*!*{}@*', '*user*': '*!*{}*@*',
+    'host': '*!*@{}', 'host*': '*!*@{}*',
+    '*host': '*!*@*{}', '*host*': '*!*@*{}*',
 }
+#: All valid n!u@h patterns on which we can act
+ALL_PATTERNS = frozenset(PATTERN_GLOBS)
 #: sqlite3 database for us. Use :meth:`db_fname` to get the real full path;
 #: this here is relative to the data directory
 DB_FNAME = 'chanserv.db'
@@ -39,24 +45,48 @@ INSERT_QUERY = '''
 INSERT INTO bans (glob, chan, is_quiet, expire) VALUES (?, ?, ?, ?);
 '''
 FIND_OLD_QUERY = '''
-SELECT rowid, * FROM bans WHERE expire < ? AND deleted = 0;
+SELECT rowid, is_quiet, chan, glob FROM bans WHERE expire < ? AND deleted = 0;
 '''
-#: Weechat timer hook on our reoccuriring event for deleting old bans
+#: Query string for the soonest time at which a ban we haven't yet deleted
+#: expires, or NULL if there are none
+NEXT_EXPIRE_QUERY = '''
+SELECT MIN(expire) FROM bans WHERE deleted = 0;
+'''
+#: Our long-lived connection to the sqlite3 database. Use :meth:`db_conn` to
+#: get it; it is opened on first use.
+DB_CONN = None
+#: Our argument parser for master-given commands. Use :meth:`_parser` to get
+#: it; it is built on first use.
+PARSER = None
+#: Weechat timer hook on our event for deleting old bans, if one is scheduled
 DELETE_BAN_TIMER_HOOK = None
-#: Interval, in seconds, with which we check for old bans that we should
-#: delete. Ideally we wouldn't poll, but if we must, then ideally we wouldn't
-#: poll so often. It has been lowered from hourly to this because the
-#: botabuse module issues very short mutes through us. Also now the joinspam
-#: module issues bans >1h but <1d.
-DELETE_BAN_INTERVAL = 10
-# DELETE_BAN_INTERVAL = 60 * 60
+#: The longest, in seconds, we will wait before checking for old bans that we
+#: should delete. We don't poll; instead we wake up when the next ban expires,
+#: and not at all if there are no bans to expire. But we still check at least
+#: this often in case the clock jumps.
+DELETE_BAN_INTERVAL_MAX = 60 * 60
 
 
 def db_fname():
     return os.path.join(tmb.datadir(), DB_FNAME)
 
 
-def _pattern_to_glob_string(pat):  # noqa: C901
+def db_conn():
+    ''' Return our connection to the database, opening it if needed.
+
+    We keep one connection open for as long as we are loaded instead of
+    opening the file for every command and every timer tick. The database is
+    put in WAL mode, which lets a transaction commit without rewriting the
+    main database file and with fewer fsyncs. '''
+    global DB_CONN
+    if DB_CONN is None:
+        DB_CONN = sqlite3.connect(db_fname())
+        DB_CONN.execute('PRAGMA journal_mode=WAL')
+        DB_CONN.execute('PRAGMA synchronous=NORMAL')
+    return DB_CONN
+
+
+def _pattern_to_glob_string(pat):
     ''' Convert pattern *pat* into a "glob string" for chanserv.
 
     ::
@@ -69,39 +99,15 @@ def _pattern_to_glob_string(pat):  # noqa: C901
     And likewise for user- and host-based patterns. If *pat* is not a valid
     pattern, return ``None``.
     '''
-    if pat not in ALL_PATTERNS:
-        return None
-    # here we go. can't think of anything better at the moment
-    if pat == 'nick':
-        return '{}!*@*'
-    elif pat == 'nick*':
-        return '{}*!*@*'
-    elif pat == '*nick':
-        return '*{}!*@*'
-    elif pat == '*nick*':
-        return '*{}*!*@*'
-    elif pat == 'user':
-        return '*!{}@*'
-    elif pat == 'user*':
-        return '*!{}*@*'
-    elif pat == '*user':
-        return '*!*{}@*'
-    elif pat == '*user*':
-        return '*!*{}*@*'
-    elif pat == 'host':
-        return '*!*@{}'
-    elif pat == 'host*':
-        return '*!*@{}*'
-    elif pat == '*host':
-        return '*!*@*{}'
-    elif pat == '*host*':
-        return '*!*@*{}*'
-    # either a programming error in the above mash of strings, or some new
-    # pattern in ALL_PATTERNS that we didn't account for
-    return None
+    return PATTERN_GLOBS.get(pat)
 
 
 def _parser():
+    ''' Return the parser for master-given commands, building it the first
+    time. '''
+    global PARSER
+    if PARSER is not None:
+        return PARSER
     p = ArgumentParser()
     p.add_argument('cmd', choices=['quiet', 'akick'])
     # comma-seperated list of '#chan1,#chan2' or 'all'
@@ -113,6 +119,7 @@ def _parser():
     p.add_argument('-p', '--permanent', action='store_true')
     # Duration, in days, of a temporary ban
     p.add_argument('-d', '--duration', type=float, default=TEMP_BAN_DAYS)
+    PARSER = p
     return p
 
 
@@ -127,11 +134,11 @@ def _try_parse(p, s):
 def _handle_command(master_nick, args):
     ''' *master* told use to execute a valid command, described in *args*. Do
     it and return the number of new bans we create '''
-    num_new_bans = 0
     # Get channels, and make sure we ignore any that aren't moderated chans
-    chans = args.chans
-    ignored_chans = {c for c in chans if c not in tmb.mod_chans()}
-    chans = {c for c in chans if c not in ignored_chans}
+    mod_chans = tmb.mod_chans_set()
+    chans = set(args.chans)
+    ignored_chans = chans - mod_chans
+    chans &= mod_chans
     if len(ignored_chans):
         tmb.log('Ignoring non-moderated channels {}', ', '.join(ignored_chans))
     # Get the :class:`UserStr` for the given nick, if possible
@@ -142,10 +149,10 @@ def _handle_command(master_nick, args):
             'patterns', args.nick)
     # Get only the valid patterns, then remove non-nick pats if needed, and log
     # about all ignored patterns
-    pats = {p for p in args.pats if p in ALL_PATTERNS}
+    pats = set(args.pats) & ALL_PATTERNS
     if not user:
         pats = {p for p in pats if 'nick' in p}
-    ignored_pats = {p for p in pats if p not in args.pats}
+    ignored_pats = set(args.pats) - pats
     if len(ignored_pats):
         tmb.log('Ignoring patterns: {}', ', '.join(ignored_pats))
     now = int(time.time())
@@ -155,33 +162,34 @@ def _handle_command(master_nick, args):
     else:
         expire = now + args.duration * SECS_IN_DAY
     expire = int(expire)
-    # Now act on all the valid patterns that are left
-    db_conn = sqlite3.connect(db_fname())
-    with db_conn:
-        # execute each of the bans
-        for pat in pats:
-            # get glob for this ban pattern
-            glob = _pattern_to_glob_string(pat)
-            if 'nick' in pat:
-                glob = glob.format(args.nick.lower())
-            elif 'user' in pat:
-                glob = glob.format(user.user)
-            elif 'host' in pat:
-                glob = glob.format(user.host)
-            else:
-                assert None, 'nick, user, or host must have been in glob'
-            # here we go, do it for each channel
-            for chan in chans:
-                s = '{cmd} {chan} add {glob} {reason}'.format(
-                    cmd=args.cmd, chan=chan,
-                    glob=glob, reason=args.reason)
-                msg(tmb.chanserv_user().nick, s)
-                tmb.log(s + ' (by {})'.format(master_nick))
-                # save it in the db
-                db_conn.execute(INSERT_QUERY, (
-                    glob, chan, 1 if args.cmd == 'quiet' else 0, expire))
-                num_new_bans += 1
-    db_conn.close()
+    # Now act on all the valid patterns that are left, remembering the rows to
+    # save in the db so they can all be inserted at once
+    new_rows = []
+    # execute each of the bans
+    for pat in pats:
+        # get glob for this ban pattern
+        glob = _pattern_to_glob_string(pat)
+        if 'nick' in pat:
+            glob = glob.format(args.nick.lower())
+        elif 'user' in pat:
+            glob = glob.format(user.user)
+        elif 'host' in pat:
+            glob = glob.format(user.host)
+        else:
+            assert None, 'nick, user, or host must have been in glob'
+        # here we go, do it for each channel
+        for chan in chans:
+            s = '%s %s add %s %s' % (args.cmd, chan, glob, args.reason)
+            msg(tmb.chanserv_user().nick, s)
+            tmb.log('{} (by {})', s, master_nick)
+            new_rows.append((
+                glob, chan, 1 if args.cmd == 'quiet' else 0, expire))
+    # save them all in the db in one transaction
+    with db_conn() as conn:
+        conn.executemany(INSERT_QUERY, new_rows)
+    # one of these might expire before the ban we were waiting on
+    _schedule_next()
+    num_new_bans = len(new_rows)
     return num_new_bans
 
 
@@ -211,21 +219,16 @@ def internal_handle_command(
     reason = reason.strip()
     if not len(chans) or not len(pats) or not len(reason) or not len(nick):
         return False
-    s = '{act} {chans_csv} {n} {pats_csv} {r} {perm} {dur}'.format(
-        act='quiet' if is_quiet else 'akick',
-        chans_csv=lcsv(chans),
-        n=nick,
-        pats_csv=lcsv(pats),
-        r=reason,
-        perm='--permanent' if is_permanent else '',
-        dur='--duration %.9f' % (duration,) if not is_permanent else '')
-    args = _try_parse(_parser(), s)
-    if not args:
-        # error should already be logged
-        return False
-    args.pats = lcsv(args.pats)
-    args.chans = lcsv(args.chans)
-    args.reason = ' '.join(args.reason) + ' (tmb)'
+    # We already have everything a parsed command would give us, so build the
+    # args directly instead of making a command string only to parse it.
+    args = Namespace(
+        cmd='quiet' if is_quiet else 'akick',
+        chans=list(chans),
+        nick=nick,
+        pats=list(pats),
+        reason=' '.join(reason.split()) + ' (tmb)',
+        permanent=is_permanent,
+        duration=float(duration))
     num_new = _handle_command(tmb.my_nick(), args)
     return num_new > 0
 
@@ -241,11 +244,11 @@ def handle_command(user, where, message):
     if not args:
         # error message already logged
         return w.WEECHAT_RC_OK
-    args.pats = lcsv(args.pats)
+    args.pats = lcsv_parse(args.pats)
     if args.chans == 'all':
         args.chans = tmb.mod_chans()
     else:
-        args.chans = lcsv(args.chans)
+        args.chans = lcsv_parse(args.chans)
     args.reason = ' '.join(args.reason) + ' (tmb)'
     _handle_command(user.nick, args)
     return w.WEECHAT_RC_OK
@@ -253,7 +256,6 @@ def handle_command(user, where, message):
 
 def initialize():
     ''' Called whenever we are (re)starting '''
-    db_conn = sqlite3.connect(db_fname())
     bans_schema = '''
 CREATE TABLE IF NOT EXISTS bans (
     glob TEXT NOT NULL,
@@ -262,26 +264,45 @@ CREATE TABLE IF NOT EXISTS bans (
     is_quiet BOOLEAN NOT NULL CHECK (is_quiet IN (0, 1)),
     deleted BOOLEAN DEFAULT 0 CHECK (deleted IN (0, 1))
 );'''
-    with db_conn:
-        db_conn.execute(bans_schema)
-    db_conn.close()
-    timer_cb()
+    # Only the bans we haven't yet deleted are ever searched by expiration
+    # time (see :data:`FIND_OLD_QUERY`), so only index those. This keeps the
+    # once-every-few-seconds lookup from scanning every ban we have ever made.
+    pending_index = '''
+CREATE INDEX IF NOT EXISTS idx_bans_pending ON bans (expire)
+    WHERE deleted = 0;'''
+    with db_conn() as conn:
+        conn.execute(bans_schema)
+        conn.execute(pending_index)
+    _delete_old_bans()
+    _schedule_next()
 
 
 def timer_cb():
+    global DELETE_BAN_TIMER_HOOK
+    # Forget the hook. It was for a single call, so weechat removes it itself
+    # once we return and there's no need to unhook it.
+    DELETE_BAN_TIMER_HOOK = None
     _delete_old_bans()
     _schedule_next()
     return w.WEECHAT_RC_OK
 
 
 def _schedule_next():
+    ''' Schedule our timer callback for just after the next ban expires,
+    replacing any already scheduled. If there are no bans left to expire, we
+    don't schedule one at all; the next new ban will. '''
     global DELETE_BAN_TIMER_HOOK
-    global DELETE_BAN_INTERVAL
     if DELETE_BAN_TIMER_HOOK:
         w.unhook(DELETE_BAN_TIMER_HOOK)
         DELETE_BAN_TIMER_HOOK = None
+    next_expire = db_conn().execute(NEXT_EXPIRE_QUERY).fetchone()[0]
+    if next_expire is None:
+        return
+    # FIND_OLD_QUERY wants bans that expired strictly before now, hence +1
+    after = next_expire - int(time.time()) + 1
+    after = min(max(after, 1), DELETE_BAN_INTERVAL_MAX)
     DELETE_BAN_TIMER_HOOK = w.hook_timer(
-        int(DELETE_BAN_INTERVAL * 1000),  # interval, num ms
+        int(after * 1000),  # interval, num ms
         0,  # align_second, don't care
         1,  # call once, we'll schedule ourselves again
         # Function to call. NOTE: this is NOT our timer_cb(). The
@@ -296,21 +317,16 @@ def _schedule_next():
 def _delete_old_bans():
     # tmb.log('Looking for old bans to delete')
     now = int(time.time())
-    db_conn = sqlite3.connect(db_fname())
-    db_conn.row_factory = sqlite3.Row
-    with db_conn:
-        rows = db_conn.execute(FIND_OLD_QUERY, (now,))
+    deleted_rowids = []
+    with db_conn() as conn:
+        rows = conn.execute(FIND_OLD_QUERY, (now,))
         # tmb.log('These are old undeleted rows:')
-        for row in rows:
-            quiet_or_akick = 'quiet' if row['is_quiet'] else 'akick'
-            chan = row['chan']
-            glob = row['glob']
+        for rowid, is_quiet, chan, glob in rows:
+            quiet_or_akick = 'quiet' if is_quiet else 'akick'
             tmb.log(
                 'Deleting old {} on {} in {}', quiet_or_akick, glob, chan)
-            s = '{which} {chan} del {glob}'.format(
-                which=quiet_or_akick,
-                chan=chan, glob=glob)
+            s = '%s %s del %s' % (quiet_or_akick, chan, glob)
             msg(tmb.chanserv_user().nick, s)
-            q = 'UPDATE bans SET deleted = 1 WHERE rowid = ?'
-            db_conn.execute(q, (row['rowid'],))
-    db_conn.close()
+            deleted_rowids.append((rowid,))
+        q = 'UPDATE bans SET deleted = 1 WHERE rowid = ?'
+        conn.executemany(q, deleted_rowids)
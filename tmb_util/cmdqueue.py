@@ -10,9 +10,23 @@ from tmb_util.tokenbucket import token_bucket
 
 # To make calling weechat stuff take fewer characters
 w = weechat
+# The clock we use for everything. It never jumps, unlike the wall clock.
+_now = time.monotonic
+# Bound once here since it is called for every message we send
+_w_command = w.command
 # The queue. Add to the right with append() and take from the left with
 # popleft().
 Q = deque()
+# The most messages we will hold in the queue. If it is full, new messages are
+# dropped instead of letting the queue grow without bound while, e.g., we are
+# disconnected. Set with initialize().
+MAX_QUEUE_LEN = 10000
+# How many messages we have dropped since we last warned about doing so
+NUM_DROPPED = 0
+# The earliest time at which we will warn again about dropping messages, and
+# the number of seconds we wait between such warnings
+NEXT_DROP_WARN = 0
+DROP_WARN_INTERVAL = 60
 # The function we call every time we send a message to update our token bucket
 TB_FUNC = None
 # Our token bucket state. We are responsible for holding on to it and passing
@@ -29,15 +43,19 @@ NEXT_SEND = 0
 TIMER_HOOK = None
 
 
-def initialize(tb_size, tb_rate):
+def initialize(tb_size, tb_rate, max_queue=MAX_QUEUE_LEN):
     ''' Initialize this queue system. tb_size is an int number of messages we
     can burst at once, and tb_rate is how often we earn a new token, as a float
-    number of seconds (i.e. how fast we can send messages in steady-state). '''
+    number of seconds (i.e. how fast we can send messages in steady-state).
+    max_queue is the most messages we will hold on to while waiting to send
+    them; more than that are dropped. '''
     global TB_FUNC
     global TB_STATE
     global NEXT_SEND
     global TIMER_HOOK
+    global MAX_QUEUE_LEN
     TB_FUNC = token_bucket(tb_size, tb_rate)
+    MAX_QUEUE_LEN = max_queue
     TB_STATE = None
     NEXT_SEND = 0
     if TIMER_HOOK:
@@ -50,34 +68,64 @@ def send(s):
     ''' Called from elsewhere to queue the sending of some command or message.
     We add it to our queue of messages and send it later s.t. we don't flood
     the network. '''
-    global Q
-    global NEXT_SEND
+    _enqueue(s)
+    _send_now()
+
+
+def send_many(ss):
+    ''' Like :meth:`send`, but for every command or message in the iterable
+    *ss*, in order. They are all queued before we try sending any of them. '''
+    for s in ss:
+        _enqueue(s)
+    _send_now()
+
+
+def _enqueue(s):
+    ''' Add *s* to the end of our queue, unless there's no room for it. '''
+    global NUM_DROPPED
+    global NEXT_DROP_WARN
+    if len(Q) >= MAX_QUEUE_LEN:
+        # Drop the new message rather than the oldest, and every so often say
+        # how many we've dropped. Log only to the core buffer, as logging to
+        # the log channel would itself queue a message.
+        NUM_DROPPED += 1
+        now = _now()
+        if now >= NEXT_DROP_WARN:
+            w.prnt('', '{}cmdqueue.py is full with {} messages. Dropped {} '
+                   'new messages.'.format(
+                       w.prefix('error'), len(Q), NUM_DROPPED))
+            NUM_DROPPED = 0
+            NEXT_DROP_WARN = now + DROP_WARN_INTERVAL
+        return
     Q.append(s)
-    _send_as_much_as_possible()
-    # If there is still stuff to send, schedule a timer to expire at the point
-    # in the future when we can send again
-    _schedule_next()
+
+
+def _send_now():
+    ''' Send as much of our queue as we can right now, and if there is still
+    stuff to send, schedule a timer to expire at the point in the future when
+    we can send again. '''
+    now = _now()
+    _send_as_much_as_possible(now)
+    _schedule_next(now)
 
 
 def timer_cb():
-    global Q
     global TIMER_HOOK
-    # Clear out the hook
-    w.unhook(TIMER_HOOK)
+    # Forget the hook. It was for a single call, so weechat removes it itself
+    # once we return and there's no need to unhook it.
     TIMER_HOOK = None
+    now = _now()
     # Send stuff
-    _send_as_much_as_possible()
+    _send_as_much_as_possible(now)
     # Schedule ourselves again, if needed
-    _schedule_next()
+    _schedule_next(now)
     return w.WEECHAT_RC_OK
 
 
-def _schedule_next():
+def _schedule_next(now):
     ''' Called when we still have stuff queued to send but have run out of
     tokens.  Schedule a weechat timer to call us back when enough time has
     passed that we've earned another token. '''
-    global Q
-    global NEXT_SEND
     global TIMER_HOOK
     # Make sure there's actually a reason for this.
     if not len(Q):
@@ -87,7 +135,6 @@ def _schedule_next():
     if TIMER_HOOK:
         return
     # Get the time difference, and make sure it is positive.
-    now = time.time()
     diff = NEXT_SEND - now
     if diff < 0:
         return
@@ -107,32 +154,41 @@ def _schedule_next():
         'cmd_q')  # callback_data. A weechat way of send data to the callback
 
 
-def _send_as_much_as_possible():
+def _send_as_much_as_possible(now):
     ''' Pull messages from the queue, sending them, until either (1) there are
     no more messages, or (2) we have to wait some amount of time into the
-    future to send more according to the token bucket. '''
+    future to send more according to the token bucket. *now* is the current
+    :data:`_now` time. '''
     global NEXT_SEND
-    global Q
     global TB_STATE
-    now = time.time()
+    # Work on local copies of our state and only store it again once done
+    next_send = NEXT_SEND
+    tb_state = TB_STATE
+    tb_func = TB_FUNC
+    popleft = Q.popleft
     # while the next time we are allowed to send is now or in the past, and
     # while there are even message we want to send
-    while NEXT_SEND <= now and len(Q):
-        # Take a message and send it
-        m = Q.popleft()
-        _send(m)
+    while next_send <= now and len(Q):
+        # Take as many messages as we know we have tokens for (always at least
+        # one, since it is time to send) and send them
+        num = max(1, tb_state['tokens']) if tb_state else 1
+        num = min(num, len(Q))
+        for _ in range(num):
+            _send(popleft())
         # Get the amount of time until we will have a positive number of tokens
         # again, and update our state
-        wait_time, TB_STATE = TB_FUNC(TB_STATE)
-        # Reset NEXT_SEND. Either it will equal now if we still have tokens
+        wait_time, tb_state = tb_func(tb_state, num, now)
+        # Reset next_send. Either it will equal now if we still have tokens
         # (wait_time is 0) or it will be in the future, in which case we will
         # stop looping.
-        NEXT_SEND = now + wait_time
+        next_send = now + wait_time
+    NEXT_SEND = next_send
+    TB_STATE = tb_state
 
 
 def _send(s):
     ''' Called internally when we're actually ready to send a command '''
-    return w.command('', s)
+    return _w_command('', s)
 
 
 def _set_options():
@@ -9,12 +9,19 @@ def lcsv(str_or_list):
     See the unit tests for examples of how ``lcsv`` works.
     '''
     if isinstance(str_or_list, str):
-        s = str_or_list
-        if not s:
-            return []
-        else:
-            return s.split(',')
-    lst = str_or_list
+        return lcsv_parse(str_or_list)
+    return lcsv_format(str_or_list)
+
+
+def lcsv_parse(s):
+    ''' Convert a str of comma-separated values to a list over the items. Use
+    this instead of :meth:`lcsv` when you know you have a str. '''
+    return s.split(',') if s else []
+
+
+def lcsv_format(lst):
+    ''' Convert a list of items to a comma-separated str. Use this instead of
+    :meth:`lcsv` when you know you have a list. '''
     return ','.join(lst)
 
 
@@ -35,3 +42,10 @@ def test_list_with_confusing_quotes():
     # Make sure the quotes don't mean shit. It's all about them commas
     a = lcsv('quotes,"multi, word", are,not,understood')
     assert a[1:3] == ['"multi', ' word"']
+
+
+def test_parse_format():
+    assert lcsv_parse('') == []
+    assert lcsv_parse('a,b,c') == ['a', 'b', 'c']
+    assert lcsv_format([]) == ''
+    assert lcsv_format(['a', 'b', 'c']) == 'a,b,c'
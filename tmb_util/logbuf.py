@@ -0,0 +1,75 @@
+''' Batching of lines for the log channel
+
+:meth:`tormodbot.log` hands us each line meant for the log channel instead of
+sending it right away. We hold on to them for a moment and then send them in
+as few NOTICEs as will fit on IRC lines, so that a burst of log lines doesn't
+cost a message each from our limited send rate (see
+:mod:`tmb_util.cmdqueue`).
+
+The pending lines live here instead of in tormodbot.py because modules get
+their own copy of tormodbot.py when they import it, but they all share this
+one.
+'''
+import weechat
+# other modules/packages
+from tmb_util.msg import notice
+
+# To make calling weechat stuff take fewer characters
+w = weechat
+#: How long, in seconds, we wait for more lines before sending what we have
+FLUSH_DELAY = 0.25
+#: The most characters of log lines we put in one NOTICE. This leaves plenty
+#: of room in the 512 byte IRC line for the rest.
+MAX_NOTICE_LEN = 400
+#: What goes between two log lines sent in the same NOTICE
+SEP = ' | '
+#: The (channel, line) pairs waiting to be sent, in order
+PENDING = []
+#: Weechat timer hook for when we will send the pending lines, if any
+TIMER_HOOK = None
+
+
+def add(chan, s):
+    ''' Send log line *s* to channel *chan* soon, with any others that come in
+    before then. '''
+    global TIMER_HOOK
+    PENDING.append((chan, s))
+    if TIMER_HOOK is not None:
+        return
+    TIMER_HOOK = w.hook_timer(
+        int(FLUSH_DELAY * 1000),  # interval, num ms
+        0,  # align_second, don't care
+        1,  # call once
+        # Function to call. NOTE: this is NOT our timer_cb(). The callback
+        # function must exist in the same file as the plugin's __main__
+        # module. Thus tormodbot.py's timer_cb() is the one called, which
+        # should be written to call OUR timer_cb() when it sees our
+        # callback_data.
+        'timer_cb',
+        'logbuf')  # callback_data
+
+
+def timer_cb():
+    global TIMER_HOOK
+    TIMER_HOOK = None
+    flush()
+    return w.WEECHAT_RC_OK
+
+
+def flush():
+    ''' Send all pending lines now. Consecutive lines for the same channel are
+    joined into as few NOTICEs as possible. A single line that is already too
+    long gets a NOTICE of its own. '''
+    global PENDING
+    pending, PENDING = PENDING, []
+    chan, batch = None, ''
+    for line_chan, line in pending:
+        if batch and (
+                line_chan != chan or
+                len(batch) + len(SEP) + len(line) > MAX_NOTICE_LEN):
+            notice(chan, batch)
+            batch = ''
+        chan = line_chan
+        batch = batch + SEP + line if batch else line
+    if batch:
+        notice(chan, batch)
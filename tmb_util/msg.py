@@ -4,10 +4,13 @@ string manipulation department. Provide either notice(...) or msg(...) with :
 
 - the nick or channel you'd like to talk to,
 - a format string (or just a str), and
-- any number of args/kwargs to pass to .format(...)
+- any number of args/kwargs to pass to .format(...). If there are none, the
+  string is sent as-is.
 
 We provide join(...) so you can join a channel without having to remember
-to -noswitch. Simply pass the name of the channel you want to join.
+to -noswitch. Simply pass the name of the channel you want to join. Or use
+join_many(...) with a list of channels to join them with as few commands as
+possible.
 
 We provide mode(...) so you can easily set the mode of a channel or nick.
 Provide it with:
@@ -31,21 +34,25 @@ import weechat
 import tmb_util.cmdqueue as cmd_q
 w = weechat
 
+#: The most characters of comma-separated channels we will put in one JOIN.
+#: This leaves plenty of room in the 512 byte IRC line for the rest.
+MAX_JOIN_CHANS_LEN = 400
+
 
 def notice(who, s, *a, **kw):
     ''' Send a notice to *who* (chan or nick). The notice message is
-    ``s.format(*a, **kw)`` '''
-    s = s.format(*a, **kw)
-    s = '/notice {} {}'.format(who, s)
-    return _send(s)
+    ``s.format(*a, **kw)``, or just *s* if there are no args to format. '''
+    if a or kw:
+        s = s.format(*a, **kw)
+    return _send('/notice ' + who + ' ' + s)
 
 
 def msg(who, s, *a, **kw):
     ''' Send a PRIVMSG to *who* (chan or nick). The message is ``s.format(*a,
-    **kw)`` '''
-    s = s.format(*a, **kw)
-    s = '/msg {} {}'.format(who, s)
-    return _send(s)
+    **kw)``, or just *s* if there are no args to format. '''
+    if a or kw:
+        s = s.format(*a, **kw)
+    return _send('/msg ' + who + ' ' + s)
 
 
 def join(what):
@@ -54,13 +61,34 @@ def join(what):
     return _send(s)
 
 
+def join_many(chans):
+    ''' Join all the given channels, as few JOINs as possible. Each JOIN is
+    for a comma-separated list of channels that fits on one IRC line. '''
+    cmds = []
+    batch = ''
+    for chan in chans:
+        if batch and len(batch) + 1 + len(chan) > MAX_JOIN_CHANS_LEN:
+            cmds.append('/join -noswitch ' + batch)
+            batch = ''
+        batch = batch + ',' + chan if batch else chan
+    if batch:
+        cmds.append('/join -noswitch ' + batch)
+    return cmd_q.send_many(cmds)
+
+
 def mode(what, flags, *a):
     ''' Set the given *flags* mode on *what* (chan or nick). Additional args
     contain values for flags. For example, +o needs a nick to receive op
     status. '''
-    s = '/mode {} {} {}'.format(what, flags, ' '.join(a))
-    s = s.strip()
-    return _send(s)
+    return _send(_mode_str(what, flags, *a))
+
+
+def _mode_str(what, flags, *a):
+    ''' Return the command :meth:`mode` would send '''
+    s = '/mode ' + what + ' ' + flags
+    if a:
+        s += ' ' + ' '.join(a)
+    return s
 
 
 def kick(chan, nick, reason):
@@ -81,12 +109,12 @@ def voice(chan, nick):
 def voices(chan, nicks):
     ''' Give voice to the given nicks on the given channel '''
     MAX = 4
-    i = 0
-    while i < len(nicks):
-        ns = nicks[i:i+MAX+1]
+    cmds = []
+    for i in range(0, len(nicks), MAX):
+        ns = nicks[i:i+MAX]
         flags = '+' + 'v' * len(ns)
-        mode(chan, flags, *ns)
-        i += MAX
+        cmds.append(_mode_str(chan, flags, *ns))
+    return cmd_q.send_many(cmds)
 
 
 def reconnect(server):
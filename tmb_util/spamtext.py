@@ -0,0 +1,48 @@
+''' Checks on the text of messages for known spam
+
+These don't need weechat, so unlike the modules that use them they can be unit
+tested.
+'''
+import re
+
+#: Regex that will earn you an immediate k-line if seen. Each alternative is
+#: a named group, so one search over the message both finds spam and tells
+#: which kind; see :data:`KLINE_REASONS`.
+#:
+#: This must stay a case-insensitive regex. re.IGNORECASE folds case for some
+#: characters, such as dotless ı and dotted İ matching ``i``, that
+#: ``str.lower()`` doesn't, and the spam uses them as look-alikes.
+KLINE_RE = re.compile(
+    '(?P<midipix>libera.*?midipix)|(?P<imgur>imgur.*?com)', re.IGNORECASE)
+#: Map from the name of each group in :data:`KLINE_RE` to the reason to give
+#: when it matches
+KLINE_REASONS = {
+    'midipix': 'libera/midipix regex',
+    'imgur': 'imgur.com link',
+}
+
+
+def kline_reason(message):
+    ''' Return the reason from :data:`KLINE_REASONS` if :data:`KLINE_RE`
+    matches *message*, or ``None`` if it doesn't. If more than one kind of
+    spam is in *message*, the reason is for the one that starts first. '''
+    m = KLINE_RE.search(message)
+    if m is None:
+        return None
+    return KLINE_REASONS[m.lastgroup]
+
+
+def test_kline_reason():
+    assert kline_reason('join libera now, see midipix') == \
+        'libera/midipix regex'
+    assert kline_reason('https://i.imgur.com/foo.png') == 'imgur.com link'
+    assert kline_reason('LIBERA MIDIPIX') == 'libera/midipix regex'
+    assert kline_reason('hello, world') is None
+    assert kline_reason('midipix then libera') is None
+    assert kline_reason('imgur.com and libera midipix') == 'imgur.com link'
+
+
+def test_kline_reason_dotless_and_dotted_i():
+    assert kline_reason('lıbera mıdıpıx') == 'libera/midipix regex'
+    assert kline_reason('LİBERA MİDİPİX') == 'libera/midipix regex'
+    assert kline_reason('ımgur.com') == 'imgur.com link'
@@ -1,4 +1,4 @@
-from time import time
+from time import monotonic
 
 
 def token_bucket(size_, refill_rate_):
@@ -16,12 +16,15 @@ def token_bucket(size_, refill_rate_):
 
     The function relies on the caller to keep track of its state.
 
-    It takes one argument: its previous state
+    It takes one argument: its previous state. It optionally takes a second:
+    the number of actions just performed (default 1). Passing *n* is the same
+    as calling it *n* times in a row. And optionally a third: the current
+    :meth:`time.monotonic` time, if the caller already has it.
     It returns two values:
     - the amount of time that must be waited before doing another action; and
     - its new state '''
 
-    def closure_token_bucket(state):
+    def closure_token_bucket(state, num=1, now=None):
         size = size_
         refill_rate = refill_rate_
         # If no state yet, initialize it.
@@ -32,7 +35,8 @@ def token_bucket(size_, refill_rate_):
         state['tokens'] -= 1
         # Now calculate how many more tokens we can give ourselves based on how
         # much time has passed since the last action
-        now = time()
+        if now is None:
+            now = monotonic()
         time_since_last_action = now - state['last_action']
         state['last_action'] = now
         # Gives ourselves more tokens until
@@ -42,6 +46,10 @@ def token_bucket(size_, refill_rate_):
                 time_since_last_action > refill_rate:
             state['tokens'] += 1
             time_since_last_action -= refill_rate
+        # Spend the tokens for the rest of the actions. Had we been called once
+        # per action, no time would have passed between these calls, so none
+        # of them would have earned any tokens back.
+        state['tokens'] -= num - 1
         if state['tokens'] > 0:
             return 0, state
         else:
@@ -53,3 +61,26 @@ def token_bucket(size_, refill_rate_):
             return ((1 + (-1 * state['tokens'])) * refill_rate), state
 
     return closure_token_bucket
+
+
+def test_burst_then_wait():
+    tb = token_bucket(3, 2)
+    wait, state = tb(None, now=1000)
+    assert wait == 0
+    wait, state = tb(state, now=1000)
+    assert wait == 0
+    wait, state = tb(state, now=1000)
+    assert wait == 2
+
+
+def test_num_same_as_many_calls():
+    tb = token_bucket(5, 2)
+    for num in range(1, 8):
+        for elapsed in (0, 1, 3, 9, 100):
+            one_state = tb(None, now=1000)[1]
+            many_state = dict(one_state)
+            for _ in range(num):
+                one_wait, one_state = tb(one_state, now=1000 + elapsed)
+            many_wait, many_state = tb(many_state, num, 1000 + elapsed)
+            assert one_wait == many_wait
+            assert one_state == many_state
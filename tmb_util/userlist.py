@@ -10,6 +10,15 @@ from tmb_util.userstr import UserStr
 #: Our cache of data. Keys are channels (like ``#foo``) and values are sets of
 #: :class:`UserStr`.
 D = {}
+#: Index over :data:`D` from lowercase nick to the :class:`UserStr` with that
+#: nick, so :meth:`nick_to_user` doesn't have to search every channel.
+NICK_IDX = {}
+#: Index over :data:`D` from :class:`UserStr` to the set of channels they are
+#: in, so :meth:`user_in_chans` doesn't have to check every channel.
+USER_CHANS = {}
+#: Cache for :meth:`_monitored_chans`: the moderated channel set and raw
+#: log_chan option it was built from, and the frozenset built from them.
+MONITORED_CHANS = (None, None, frozenset())
 # To make calling weechat stuff take fewer characters
 w = weechat
 #: Weechat timer hook on our reoccurring event on refreshing all nick!user@host
@@ -27,33 +36,40 @@ REFRESH_TIMER_INTERVAL_MAX = 86400
 
 
 def _monitored_chans():
-    ''' Channels in which we fetch all known :class:`UserStr` '''
-    return set(tmb.mod_chans() + [tmb.log_chan()])
+    ''' Channels in which we fetch all known :class:`UserStr`, as a frozenset.
+    It is only rebuilt when the moderated channels or the log channel change,
+    which we notice by keeping what it was built from next to it. '''
+    global MONITORED_CHANS
+    mod_chans = tmb.mod_chans_set()
+    raw_log_chan = tmb.CONF['log_chan']
+    if MONITORED_CHANS[0] is not mod_chans or \
+            MONITORED_CHANS[1] is not raw_log_chan:
+        log_chan = tmb.log_chan()
+        MONITORED_CHANS = (
+            mod_chans, raw_log_chan,
+            mod_chans | {log_chan} if log_chan else mod_chans)
+    return MONITORED_CHANS[2]
 
 
 def nick_to_user(nick):
     ''' See if we cann find a :class:`UserStr` for the given nick. If so,
     return it. Else return ``None``. '''
-    global D
-    nick = nick.lower()
-    for users_in_a_chan in D.values():
-        for user in users_in_a_chan:
-            if user.nick == nick:
-                return user
-    return None
+    return NICK_IDX.get(nick.lower())
 
 
 def user_in_chans(user):
     ''' Return all monitored channels that :class:`UserStr` *user* is in.  '''
-    global D
-    out = set()
     if not user:
-        return out
-    # Just grab the nick and search all channels with it
-    for chan, users in D.items():
-        if user in users:
-            out.add(chan)
-    return out
+        return set()
+    # Copy it so the caller can't change our index
+    return set(USER_CHANS.get(user, ()))
+
+
+def chan_has_user(chan, user):
+    ''' Whether :class:`UserStr` *user* is in monitored channel *chan*. This
+    is a single lookup in the channel's set of users, so prefer it over
+    :meth:`user_in_chans` when asking about one channel. '''
+    return user in D.get(chan, ())
 
 
 def join_cb(user, chan):
@@ -72,6 +88,8 @@ def join_cb(user, chan):
     assert chan in D
     assert isinstance(user, UserStr)
     D[chan].add(user)
+    NICK_IDX[user.nick] = user
+    USER_CHANS.setdefault(user, set()).add(chan)
 
 
 def part_cb(user, chan):
@@ -84,6 +102,18 @@ def part_cb(user, chan):
     # old_len = len(D[chan])
     if user in D[chan]:
         D[chan].remove(user)
+        user_chans = USER_CHANS.get(user)
+        if user_chans is not None:
+            user_chans.discard(chan)
+        # Forget them entirely if this was the last channel we saw them in
+        if not user_chans:
+            USER_CHANS.pop(user, None)
+            # The index may hold a different, but equal, UserStr for them,
+            # so compare by value. Check for None first, as a UserStr can't
+            # be compared to it.
+            indexed = NICK_IDX.get(user.nick)
+            if indexed is not None and indexed == user:
+                del NICK_IDX[user.nick]
     else:
         tmb.log(
             '{} left {} without us knowing they were in the chan. '
@@ -108,21 +138,33 @@ def timer_cb():
 
 
 def _reload_from_nicklists():
-    ''' Clear out our stored n!u@h and load them again from the weechat nick
-    lists '''
+    ''' Load our stored n!u@h again from the weechat nick lists.
+
+    Each channel's set is updated in place: users no longer in the channel
+    are removed and new ones are added, while the :class:`UserStr` we already
+    had for everyone else are kept. '''
     global D
-    D = {}
+    global NICK_IDX
+    global USER_CHANS
     serv = tmb.serv()
     # time_start = time.time()
     chans = _monitored_chans()
     logged_warning = False
+    # Forget channels we no longer monitor
+    for chan in [c for c in D if c not in chans]:
+        del D[chan]
+    # The loop below runs once per user in every channel, so look these up
+    # just once
+    infolist_next = w.infolist_next
+    infolist_string = w.infolist_string
     for chan in chans:
-        D[chan] = set()
+        new_users = set()
+        add_user = new_users.add
         ilist = w.infolist_get('irc_nick', '', '{},{}'.format(serv, chan))
-        while w.infolist_next(ilist):
+        while infolist_next(ilist):
             # tmb.log('{}', w.infolist_fields(ilist))
-            nick = w.infolist_string(ilist, 'name')
-            user_host = w.infolist_string(ilist, 'host')
+            nick = infolist_string(ilist, 'name')
+            user_host = infolist_string(ilist, 'host')
             if not user_host:
                 if not logged_warning:
                     tmb.log(
@@ -135,8 +177,19 @@ def _reload_from_nicklists():
                     logged_warning = True
                 continue
             s = '{}!{}'.format(nick, user_host)
-            D[chan].add(UserStr(s))
+            add_user(UserStr(s))
         w.infolist_free(ilist)
+        users = D.setdefault(chan, set())
+        # Keep only the users still here. The set keeps its own, equal,
+        # UserStr for them, and then only gains the users it is missing.
+        users -= users - new_users
+        users |= new_users
+    NICK_IDX = {}
+    USER_CHANS = {}
+    for chan, users in D.items():
+        for user in users:
+            NICK_IDX[user.nick] = user
+            USER_CHANS.setdefault(user, set()).add(chan)
     # time_end = time.time()
     # tmb.log(
     #     'Cached {} n!u@h strings in {} chans in {:0.3f} seconds',
@@ -1,34 +1,110 @@
+#: Pool of :class:`UserStr` we have made recently, keyed by the string they
+#: were made from. See :meth:`UserStr.intern`.
+POOL = {}
+#: The most :class:`UserStr` we keep in :data:`POOL`. Once full, it is emptied
+#: and starts over.
+POOL_MAX = 4096
+
+
 class UserStr:
-    ''' Store a nick/user/host parsed from nick!user@host '''
+    ''' Store a nick/user/host parsed from nick!user@host
+
+    Comparisons are case insensitive, so the lowercase forms of the parts are
+    computed once here instead of on every comparison or lookup. '''
     def __init__(self, s):
-        self._nick, s = s.split('!', 1)
-        self._user, s = s.split('@', 1)
-        self._host = s
+        self._nick, bang, s = s.partition('!')
+        self._user, at, self._host = s.partition('@')
+        if not bang or not at:
+            raise ValueError('Not a nick!user@host string')
+        self._lnick = self._nick.lower()
+        self._luser = self._user.lower()
+        self._lhost = self._host.lower()
+        #: The whole lowercase nick!user@host, which is all we need to compare
+        #: and hash
+        self._lstr = '{}!{}@{}'.format(self._lnick, self._luser, self._lhost)
+        self._hash = hash(self._lstr)
+
+    @classmethod
+    def intern(cls, s):
+        ''' Like ``UserStr(s)``, but if we've recently made a UserStr from this
+        exact *s*, return that same object instead of parsing *s* again. The
+        same people tend to show up in many events in a row. This is safe
+        because a UserStr never changes once made. '''
+        u = POOL.get(s)
+        if u is None:
+            u = cls(s)
+            if len(POOL) >= POOL_MAX:
+                POOL.clear()
+            POOL[s] = u
+        return u
 
     def __str__(self):
         return '{n}!{u}@{h}'.format(n=self._nick, u=self._user, h=self._host)
 
     def __eq__(self, rhs):
-        return self.nick == rhs.nick and \
-            self.user == rhs.user and \
-            self.host == rhs.host
+        return self._lstr == rhs._lstr
 
     def __ne__(self, rhs):
-        return self.nick != rhs.nick or \
-                self.user != rhs.user or \
-                self.host != rhs.host
+        return self._lstr != rhs._lstr
 
     @property
     def nick(self):
-        return self._nick.lower()
+        return self._lnick
 
     @property
     def user(self):
-        return self._user.lower()
+        return self._luser
 
     @property
     def host(self):
-        return self._host.lower()
+        return self._lhost
 
     def __hash__(self):
-        return hash('{}!{}@{}'.format(self._nick, self._user, self._host))
+        return self._hash
+
+
+def test_parts():
+    u = UserStr('Nick!~User@Host.Example')
+    assert u.nick == 'nick'
+    assert u.user == '~user'
+    assert u.host == 'host.example'
+    assert str(u) == 'Nick!~User@Host.Example'
+
+
+def test_case_insensitive():
+    a = UserStr('Nick!~User@Host.Example')
+    b = UserStr('nick!~user@host.example')
+    assert a == b
+    assert not a != b
+    assert hash(a) == hash(b)
+    assert len({a, b}) == 1
+
+
+def test_not_a_userstr():
+    for s in ['', 'nick', 'nick@host', 'nick!user', 'irc.example.com']:
+        try:
+            UserStr(s)
+        except ValueError:
+            pass
+        else:
+            assert False, s
+
+
+def test_different():
+    a = UserStr('nick!user@host')
+    assert a != UserStr('nick2!user@host')
+    assert a != UserStr('nick!user2@host')
+    assert a != UserStr('nick!user@host2')
+
+
+def test_intern():
+    s = 'Nick!~User@Host.Example'
+    a = UserStr.intern(s)
+    assert UserStr.intern(s) is a
+    assert UserStr.intern('nick!~user@host.example') == a
+    try:
+        UserStr.intern('nick')
+    except ValueError:
+        pass
+    else:
+        assert False
@@ -1,14 +1,27 @@
+from functools import lru_cache
+import re
 import textwrap
 
+#: Matches a run of whitespace, for collapsing it to a single space
+_WS_RE = re.compile(r'\s+')
+
 
 def _wrap_line(tw, s):
     ''' Given a :class:`textwrap.TextWrapper` and a single long line of text
     ``s``, wrap ``s`` after reducing whitespace between its words to a single
     space. '''
-    return tw.wrap(' '.join(s.split()))
+    return tw.wrap(_WS_RE.sub(' ', s).strip())
 
 
-def wrap_text(s, max_width):
+@lru_cache(maxsize=8)
+def _text_wrapper(width):
+    ''' Return a :class:`textwrap.TextWrapper` for wrapping to *width*. It
+    keeps no state between calls to its ``wrap()``, so one per width is
+    built and shared. '''
+    return textwrap.TextWrapper(width=width)
+
+
+def wrap_text_lines(s, max_width):
     ''' Wrap the given multi-line string ``s`` such that each line is no more
     than ``max_width`` characters.
 
@@ -20,36 +33,45 @@ def wrap_text(s, max_width):
 
         And this is the start of another paragraph.
 
-    This function yields wrapped lines, each *with* a trailing newline. It may,
-    in the case of the input containing multiple paragraphs, return lines that
-    are simply a single newline character.
+    This function returns a list of the wrapped lines, *without* trailing
+    newlines. It may, in the case of the input containing multiple paragraphs,
+    contain empty strings for the blank lines between them.
     '''
     # object that actually does the wrapping
-    tw = textwrap.TextWrapper(width=max_width)
-    # accumulate the current working paragraph here
-    acc = ''
+    tw = _text_wrapper(max_width)
+    out = []
+    # accumulate the lines of the current working paragraph here
+    acc = []
     # strip unnecessary whitespace from left of top-most line and right of
     # bottom-most line
     s = s.strip()
     for in_line in s.split('\n'):
-        # Append the input line to the accumulating paragraph. Add a space so
-        # that there's always *at least* one space between words. Later we will
-        # make it *exactly* one space.
-        acc += ' ' + in_line
+        # Append the input line to the accumulating paragraph. They are joined
+        # with a space so that there's always *at least* one space between
+        # words. Later we will make it *exactly* one space.
+        acc.append(in_line)
         # if the in_line is actually all just whitespace, then we've reached
         # the end of the current paragraph and should output it as wrapped
         # lines.
         if not len(in_line.strip()):
-            for out_line in _wrap_line(tw, acc):
-                yield out_line + '\n'
+            out.extend(_wrap_line(tw, ' '.join(acc)))
             # clear paragraph
-            acc = ''
+            acc = []
             # output a blank line before the next paragraph
-            yield '\n'
+            out.append('')
     # if there's leftover text, print it
     if len(acc):
-        for out_line in _wrap_line(tw, acc):
-            yield out_line + '\n'
+        out.extend(_wrap_line(tw, ' '.join(acc)))
+    return out
+
+
+def wrap_text(s, max_width):
+    ''' Like :meth:`wrap_text_lines`, but yields the wrapped lines, each *with*
+    a trailing newline. Lines that are simply a single newline character
+    separate paragraphs. If you are going to join the lines together anyway,
+    use ``'\\n'.join(wrap_text_lines(s, max_width))`` instead. '''
+    for line in wrap_text_lines(s, max_width):
+        yield line + '\n'
 
 
 #: Width to which to wrap lines in most (all?) tests
@@ -88,3 +110,9 @@ def test_multi_para():
     # only thing that should be kept is the newlines.
     assert _lgts(wrap_text('a\n\n  \n\t \nb', TEST_W)) == \
         'a\n\n\n\nb\n'
+
+
+def test_lines():
+    assert wrap_text_lines('', TEST_W) == ['']
+    assert wrap_text_lines('f f f f f f', TEST_W) == ['f f f f f', 'f']
+    assert wrap_text_lines('a\n\nb', TEST_W) == ['a', '', 'b']
@@ -1,18 +1,23 @@
 import weechat
 # stdlib imports
+import importlib
 import os
+import re
 import sys
 # stuff that comes with tormodbot itself
 from config import conf as CONF
-import tmb_mod.liberaham
+# Only the package. Each module in it is imported once it is enabled; see
+# _refresh_enabled_modules()
+import tmb_mod
 # other modules/packages
 import tmb_util.cmdqueue as cmd_q
 import help as tmb_help
 from tmb_util import chanserv
+from tmb_util import logbuf
 from tmb_util import userlist
-from tmb_util.msg import notice, join, mode, reconnect, oper_w_eval, close,\
-    disconnect
-from tmb_util.lcsv import lcsv
+from tmb_util.msg import notice, join, join_many, mode, reconnect, \
+    oper_w_eval, close, disconnect
+from tmb_util.lcsv import lcsv_parse, lcsv_format
 from tmb_util.userstr import UserStr
 
 
@@ -23,6 +28,12 @@ SCRIPT_AUTHOR = 'Matt Traudt <pastly@torproject.org>'
 SCRIPT_VERSION = '0.1.0'
 SCRIPT_LICENSE = 'MIT'
 SCRIPT_DESC = 'Help Tor Project moderate their many channels'
+#: The directory in which this file resides. Use :meth:`codedir`.
+CODEDIR = os.path.abspath(os.path.dirname(__file__))
+#: tormodbot's data directory, once known. Use :meth:`datadir`.
+DATADIR = None
+#: The prefix weechat puts on the names of our options
+CONF_PREFIX = 'plugins.var.python.' + SCRIPT_NAME + '.'
 
 CONNECTED = False
 #: Weechat timer hook on our event for delayed on-connect actions
@@ -30,17 +41,72 @@ CONNECTED_TIMER_HOOK = None
 #: How long to wait, in seconds, before doing delayed on-connect actions
 CONNECTED_DELAY_SECS = 5
 
-#: All modules, even those that are disabled
+#: Parses the source, target, and text out of a raw PRIVMSG line such as
+#: ``:nick!~user@host PRIVMSG #chan :the message``. The ':' before the text is
+#: optional, as it is in IRC for text that is a single word.
+PRIVMSG_RE = re.compile(r'\A:(\S+) PRIVMSG (\S+) :?(.*)\Z', re.DOTALL)
+#: Like :data:`PRIVMSG_RE`, but for NOTICE
+NOTICE_RE = re.compile(r'\A:(\S+) NOTICE (\S+) :?(.*)\Z', re.DOTALL)
+#: Cache for :meth:`_option_userstr`. Keys are option names, and values are
+#: the raw option string and the :class:`UserStr` parsed from it.
+OPTION_USERSTRS = {}
+#: Our current nick on the configured server, if known. Use :meth:`my_nick`.
+#: This is only ever set by weechat callbacks, which run in the ``__main__``
+#: copy of this file; see :meth:`_option_set` for why that matters.
+MY_NICK = None
+#: Weechat hooks on the IRC signals from our server. See
+#: :meth:`_hook_server_signals`.
+SERVER_SIGNAL_HOOKS = []
+#: Map from the name of each of our modules, which is both its file in
+#: ``tmb_mod/`` and the prefix of its options, to the name of its class. Each
+#: is only imported and constructed once it is enabled; see
+#: :meth:`_refresh_enabled_modules`. The classes are named here rather than
+#: referenced, as a module imports this file and so is only partly loaded
+#: while this file is.
+MODULE_CLASSES = {
+    'liberaham': 'LiberaHamModule',
+}
+#: All modules that have been constructed, even those that have since been
+#: disabled
 MODULES = []
+#: Only the enabled modules from :data:`MODULES`. Use
+#: :meth:`_refresh_enabled_modules` to update it; it is only kept up to date
+#: in the ``__main__`` copy of this file, which is where all the weechat
+#: callbacks that use it run.
+ENABLED_MODULES = ()
+#: Only the modules from :data:`ENABLED_MODULES` that do something with
+#: NOTICEs. Kept up to date with it.
+NOTICE_MODULES = ()
+#: Cache for :meth:`_option_set`. Keys are option names, and values are the
+#: raw option string the set was built from and the frozenset built from it.
+OPTION_SETS = {}
 
 
 def log(s, *a, **kw):
+    # format just once for both places we log to, and only if needed
+    if a or kw:
+        s = s.format(*a, **kw)
     # log to core window
-    w.prnt('', w.prefix('error') + s.format(*a, **kw))
-    # log to log channel
-    if not log_chan():
+    w.prnt('', w.prefix('error') + s)
+    # log to log channel, batched with any other lines logged around now
+    chan = log_chan()
+    if not chan:
         return
-    notice(log_chan(), s, *a, **kw)
+    logbuf.add(chan, s)
+
+
+def dlog(s, *a, **kw):
+    ''' Like :meth:`log`, but only if the debug option is on. Otherwise this
+    does nothing, not even format the message, so it is cheap to call from
+    busy places. '''
+    if not debug():
+        return
+    log(s, *a, **kw)
+
+
+def debug():
+    ''' Returns whether debug logging is enabled '''
+    return w.config_string_to_boolean(CONF['debug'])
 
 
 def serv():
@@ -49,8 +115,16 @@ def serv():
 
 
 def my_nick():
-    ''' Returns my current nick on the configured server '''
-    return w.info_get('irc_nick', serv())
+    ''' Returns my current nick on the configured server. It is remembered
+    when we connect and when we change nick, so it usually doesn't need to be
+    asked of weechat. '''
+    return MY_NICK or w.info_get('irc_nick', serv())
+
+
+def _refresh_my_nick():
+    ''' Ask weechat for our nick again and remember it for :meth:`my_nick` '''
+    global MY_NICK
+    MY_NICK = w.info_get('irc_nick', serv()) or None
 
 
 def cmd_chan():
@@ -61,19 +135,58 @@ def cmd_chan():
 def masters():
     ''' Returns the list of my currently configured masters. Nicks are
     normalized to lowercase '''
-    return lcsv(CONF['masters'].lower())
+    return lcsv_parse(CONF['masters'].lower())
 
 
 def ignores():
     ''' Returns the list of nicks which we ignore all PRIVMSG and NOTICE. Nicks
     are normalized to lowercase. '''
-    return lcsv(CONF['ignores'].lower())
+    return lcsv_parse(CONF['ignores'].lower())
 
 
 def mod_chans():
     ''' Returns the list of my currently configured channels to moderate. Chans
     are normalized to lowercase. '''
-    return lcsv(CONF['mod_chans'].lower())
+    return lcsv_parse(CONF['mod_chans'].lower())
+
+
+def _option_set(opt):
+    ''' Returns the comma-separated values of option *opt*, lowercased, as a
+    frozenset for quick membership tests on hot paths. It is only rebuilt
+    after the option changes.
+
+    The cache is keyed on the raw option string instead of being cleared by
+    :meth:`config_cb`. Modules ``import tormodbot`` and get a different copy
+    of this file than the ``__main__`` one weechat runs and calls back into,
+    but both copies share the same ``CONF``.
+
+    The values are interned, as are the channels in JOINs and PARTs, so
+    lookups against them usually succeed on an identity check. '''
+    raw = CONF[opt]
+    cached = OPTION_SETS.get(opt)
+    if cached is None or cached[0] is not raw:
+        cached = (raw, frozenset(
+            sys.intern(v) for v in lcsv_parse(raw.lower())))
+        OPTION_SETS[opt] = cached
+    return cached[1]
+
+
+def masters_set():
+    ''' Returns the same nicks as :meth:`masters`, but as a frozenset. See
+    :meth:`_option_set`. '''
+    return _option_set('masters')
+
+
+def ignores_set():
+    ''' Returns the same nicks as :meth:`ignores`, but as a frozenset. See
+    :meth:`_option_set`. '''
+    return _option_set('ignores')
+
+
+def mod_chans_set():
+    ''' Returns the same channels as :meth:`mod_chans`, but as a frozenset.
+    See :meth:`_option_set`. '''
+    return _option_set('mod_chans')
 
 
 def log_chan():
@@ -83,15 +196,26 @@ def log_chan():
     return s.lower() if s else None
 
 
+def _option_userstr(opt):
+    ''' Returns the :class:`UserStr` for the n!u@h in option *opt*. Like
+    :meth:`_option_set`, it is cached and keyed on the raw option string. '''
+    raw = CONF[opt]
+    cached = OPTION_USERSTRS.get(opt)
+    if cached is None or cached[0] is not raw:
+        cached = (raw, UserStr(raw))
+        OPTION_USERSTRS[opt] = cached
+    return cached[1]
+
+
 def nickserv_user():
     ''' Returns UserStr of the configured nickserv '''
-    return UserStr(CONF['nickserv_userstr'])
+    return _option_userstr('nickserv_userstr')
 
 
 def chanserv_user():
     ''' Returns UserStr of the configured chanserv '''
     # return UserStr('pastly!~pastly@pastly.netop.oftc.net')
-    return UserStr(CONF['chanserv_userstr'])
+    return _option_userstr('chanserv_userstr')
 
 
 def _homedir():
@@ -100,13 +224,17 @@ def _homedir():
 
 
 def datadir():
-    ''' Returns tormodbot's data directory '''
-    return os.path.join(_homedir(), 'tmb_data')
+    ''' Returns tormodbot's data directory. It can't change while we are
+    running, so weechat is only asked for its home directory once. '''
+    global DATADIR
+    if DATADIR is None:
+        DATADIR = os.path.join(_homedir(), 'tmb_data')
+    return DATADIR
 
 
 def codedir():
     ''' Returns the directory in which this file resides '''
-    return os.path.abspath(os.path.dirname(__file__))
+    return CODEDIR
 
 
 def code_url():
@@ -122,14 +250,9 @@ def timer_cb(data, remaining_calls):
     set, then it was that module that set a timer that expired, so we should
     hand control off to it. Otherwise it was us.
     '''
-    if data == 'cmd_q':
-        return cmd_q.timer_cb()
-    elif data == 'userlist':
-        return userlist.timer_cb()
-    elif data == 'chanserv':
-        return chanserv.timer_cb()
-    elif data == 'connected':
-        return delayed_connect_cb()
+    func = TIMERS.get(data)
+    if func is not None:
+        return func()
     log(
         'timer_cb called with empty or unrecognized data arg "{}", so don\'t '
         'know who to tell about this.', data)
@@ -142,26 +265,38 @@ def delayed_connect_cb():
         'Trying to oper up with secure username "oper_user" and secure '
         'password "oper_pw". Make sure these are set with /secure.')
     oper_w_eval('${sec.data.oper_user}', '${sec.data.oper_pw}')
+    me = my_nick()
     # set god mode so we can definitely +o ourselves in all our mod chans
-    mode(my_nick(), '+S')
-    # make sure we're in all the chans for modding, and for logging
-    for c in mod_chans():
-        join(c)
-    if log_chan():
-        join(log_chan())
-    if cmd_chan():
-        join(cmd_chan())
-    # make sure we're op in all the mod chans, and force the mode to +Mz
+    mode(me, '+S')
+    # make sure we're in all the chans for modding, and for logging and
+    # commands, in as few JOINs as possible. The log and cmd chans are often
+    # the same chan, so only list each chan once.
+    chans = mod_chans() + [c for c in (log_chan(), cmd_chan()) if c]
+    join_many(dict.fromkeys(chans))
+    # make sure we're op in all the mod chans, and force the mode to +Mz, all
+    # with one MODE per chan
     for c in mod_chans():
-        mode(c, '+o', my_nick())
-        mode(c, '+Mz')
+        mode(c, '+oMz', me)
     # unset god mode
-    mode(my_nick(), '-S')
+    mode(me, '-S')
     # make sure we know about all users in all chans
     userlist.connect_cb()
     return w.WEECHAT_RC_OK
 
 
+#: Map from the callback_data of each of our timers to the function that
+#: :meth:`timer_cb` should call when it expires. The tmb_util modules' own
+#: timer_cb are looked up when called, not here: this file is imported by
+#: those modules while they are still being loaded themselves.
+TIMERS = {
+    'cmd_q': lambda: cmd_q.timer_cb(),
+    'userlist': lambda: userlist.timer_cb(),
+    'chanserv': lambda: chanserv.timer_cb(),
+    'logbuf': lambda: logbuf.timer_cb(),
+    'connected': delayed_connect_cb,
+}
+
+
 def connected_cb(data, signal, signal_data):
     ''' Callback for when we have (dis)connected to a server '''
     # data: empty
@@ -170,6 +305,7 @@ def connected_cb(data, signal, signal_data):
     global CONNECTED
     global CONNECTED_TIMER_HOOK
     CONNECTED = signal == "irc_server_connected"
+    _refresh_my_nick()
     log('We are {}connected to {}', '' if CONNECTED else 'not ', signal_data)
     # If we have just connected, wait a little bit before doing anything to
     # hopefully win the identify-to-nickserv race. Yes this race still exists
@@ -193,18 +329,29 @@ def connected_cb(data, signal, signal_data):
     return w.WEECHAT_RC_OK
 
 
+def nick_cb(data, signal, signal_data):
+    ''' Callback for when we see a NICK '''
+    # signal is for example: "oftc,irc_raw_in2_NICK"
+    # signal_data is for example: ":oldnick!~user@host NICK :newnick"
+    old_nick = _source_nick(signal_data)
+    # weechat has already handled the NICK, so it knows our new nick
+    if MY_NICK is None or old_nick == MY_NICK.lower():
+        _refresh_my_nick()
+    return w.WEECHAT_RC_OK
+
+
 def join_cb(data, signal, signal_data):
     ''' Callback for when we see a JOIN '''
     # signal is for example: "freenode,irc_in2_join"
     # signal_data is IRC message, for example: ":nick!user@host JOIN :#channel"
-    data = w.info_get_hashtable('irc_message_parse', {'message': signal_data})
-    user, chan = UserStr(data['host']), data['channel']
+    parsed = w.info_get_hashtable(
+        'irc_message_parse', {'message': signal_data})
+    user = UserStr.intern(parsed['host'])
+    chan = sys.intern(parsed['channel'].lower())
     userlist.join_cb(user, chan)
     # Tell all da modules
-    global MODULES
-    for mod in [m for m in MODULES if m.enabled()]:
-        if mod.enabled():
-            mod.join_cb(user, chan)
+    for mod in ENABLED_MODULES:
+        mod.join_cb(user, chan)
     return w.WEECHAT_RC_OK
 
 
@@ -212,8 +359,10 @@ def part_cb(data, signal, signal_data):
     ''' Callback for when we see a PART '''
     # signal is for example: "freenode,irc_in2_part"
     # signal_data is IRC message, for example: ":nick!user@host PART :#channel"
-    data = w.info_get_hashtable('irc_message_parse', {'message': signal_data})
-    user, chan = UserStr(data['host']), data['channel']
+    parsed = w.info_get_hashtable(
+        'irc_message_parse', {'message': signal_data})
+    user = UserStr.intern(parsed['host'])
+    chan = sys.intern(parsed['channel'].lower())
     userlist.part_cb(user, chan)
     return w.WEECHAT_RC_OK
 
@@ -222,18 +371,18 @@ def _handle_command_mod(dest, chan, who):
     ''' Handle the 'mod' command from masters, sending any response messages to
     dest. '''
     if not chan:
-        notice(dest, lcsv(mod_chans()))
+        notice(dest, lcsv_format(mod_chans()))
         return
     chans = set(mod_chans())
     chans.add(chan)
-    w.config_set_plugin('mod_chans', lcsv(chans))
-    notice(dest, 'Okay. mod_chans={}', lcsv(chans))
+    w.config_set_plugin('mod_chans', lcsv_format(chans))
+    notice(dest, 'Okay. mod_chans={}', lcsv_format(chans))
     log('{} told me to start modding {}', who, chan)
-    mode(my_nick(), '+S')
+    me = my_nick()
+    mode(me, '+S')
     join(chan)
-    mode(chan, '+o', my_nick())
-    mode(chan, '+Mz')
-    mode(my_nick(), '-S')
+    mode(chan, '+oMz', me)
+    mode(me, '-S')
 
 
 def _handle_command_unmod(dest, chan, who):
@@ -242,76 +391,123 @@ def _handle_command_unmod(dest, chan, who):
         notice(dest, 'Not modding {}', chan)
         return
     chans.remove(chan)
-    w.config_set_plugin('mod_chans', lcsv(chans))
-    notice(dest, 'Okay. mod_chans={}', lcsv(chans))
+    w.config_set_plugin('mod_chans', lcsv_format(chans))
+    notice(dest, 'Okay. mod_chans={}', lcsv_format(chans))
     log('{} told me to stop modding {}', who, chan)
     close(chan)
 
 
-def handle_command(user, where, message):
+def handle_command(user, where, message, is_pm):
     ''' UserStr *user* sent us str *message* that maybe should be treated as a
     command.  The caller DID verified this user has permission to command us
     and that they sent us the message in a proper place. The caller does NOT
     verify that the message is a valid command. The str *where* indicates the
     place where we we got it: either '#channel' if the cmd channel, or our own
-    nick.  '''
+    nick. The caller already knows which, and tells us with bool *is_pm*. '''
     # If it came in as a PM: *where* is our own nick and any response should go
     # to the user's nick. If it came in via the command channel: any response
     # should go to the command channel
-    dest = user.nick if where != cmd_chan() else cmd_chan()
-    words = message.split()
+    dest = user.nick if is_pm else where
+    # Only the first word picks the command, so don't split up the rest
+    words = message.split(None, 1)
     if not len(words):
         return w.WEECHAT_RC_OK
-    if words[0].lower() == 'ping':
-        notice(
-            dest, 'pong' if where == my_nick() else user.nick + ': pong')
-        return w.WEECHAT_RC_OK
-    elif words[0].lower() == 'reconnect':
-        notice(dest, 'Okay. Be right back!')
-        reconnect(serv())
-        return w.WEECHAT_RC_OK
-    elif words[0].lower() == 'help':
-        return tmb_help.handle_command(user, where, message)
-    elif words[0].lower() == 'mod':
-        chan = words[1].lower() if len(words) == 2 else None
-        _handle_command_mod(dest, chan, user.nick)
-        return w.WEECHAT_RC_OK
-    elif words[0].lower() == 'unmod':
-        if len(words) != 2:
-            notice(dest, 'Provide one channel name')
-            return w.WEECHAT_RC_OK
-        chan = words[1].lower()
-        _handle_command_unmod(dest, chan, user.nick)
-        return w.WEECHAT_RC_OK
-    elif words[0].lower() == 'die':
-        notice(dest, 'Okay. I won\'t be back. Sorry if I was bad :\'(')
-        disconnect(serv())
-        return w.WEECHAT_RC_OK
+    handler = COMMANDS.get(words[0].lower())
     # This function should NOT assume that the given message contains a valid
     # command.
+    if handler is None:
+        return w.WEECHAT_RC_OK
+    return handler(user, where, dest, words[1] if len(words) == 2 else '')
+
+
+def _cmd_ping(user, where, dest, args):
+    notice(dest, 'pong' if dest == user.nick else user.nick + ': pong')
+    return w.WEECHAT_RC_OK
+
+
+def _cmd_reconnect(user, where, dest, args):
+    notice(dest, 'Okay. Be right back!')
+    reconnect(serv())
+    return w.WEECHAT_RC_OK
+
+
+def _cmd_help(user, where, dest, args):
+    return tmb_help.handle_command(user, where, 'help ' + args)
+
+
+def _cmd_mod(user, where, dest, args):
+    args = args.split()
+    chan = args[0].lower() if len(args) == 1 else None
+    _handle_command_mod(dest, chan, user.nick)
     return w.WEECHAT_RC_OK
 
 
+def _cmd_unmod(user, where, dest, args):
+    args = args.split()
+    if len(args) != 1:
+        notice(dest, 'Provide one channel name')
+        return w.WEECHAT_RC_OK
+    chan = args[0].lower()
+    _handle_command_unmod(dest, chan, user.nick)
+    return w.WEECHAT_RC_OK
+
+
+def _cmd_die(user, where, dest, args):
+    notice(dest, 'Okay. I won\'t be back. Sorry if I was bad :\'(')
+    disconnect(serv())
+    return w.WEECHAT_RC_OK
+
+
+#: Map from each command a master can give us to the function that handles it.
+#: Each is called with the :class:`UserStr` that sent it, where they sent it
+#: (see :meth:`handle_command`), where to respond, and the rest of the message
+#: after the command word.
+COMMANDS = {
+    'ping': _cmd_ping,
+    'reconnect': _cmd_reconnect,
+    'help': _cmd_help,
+    'mod': _cmd_mod,
+    'unmod': _cmd_unmod,
+    'die': _cmd_die,
+}
+
+
+def _source_nick(signal_data):
+    ''' Return the lowercase nick from the ``:nick!user@host`` at the start of
+    the raw IRC line *signal_data*, or ``None`` if it doesn't start with one
+    (e.g. it's from a server). This is much cheaper than parsing the whole
+    line, so use it to throw away lines we don't care about. '''
+    end = signal_data.find(' ')
+    bang = signal_data.find('!', 1, end)
+    if bang < 0:
+        return None
+    return signal_data[1:bang].lower()
+
+
 def privmsg_cb(data, signal, signal_data):
     ''' Callback for when we see a PRIVMSG '''
     # signal is for example: "oftc,irc_raw_in2_PRIVMSG"
     # signal_data is for example:
     #     ":nick!~user@host PRIVMSG #chan :the message" (if sent to a channel)
     #     ":nick!~user@host PRIVMSG mynick :the message" (if sent to us)
+    # If it is a user to ignore, ignore them before doing any more work
+    nick = _source_nick(signal_data)
+    if nick in ignores_set():
+        dlog('Ignore PRIVMSG from {}', nick)
+        return w.WEECHAT_RC_OK
     #############
     # Parse data
     #############
-    # remove leading ':'
-    assert signal_data.startswith(':')
-    signal_data = signal_data[1:]
-    # parse out user that sent this message
-    user, signal_data = signal_data.split(' ', 1)
-    user = UserStr(user)
-    # trim cruft
-    assert signal_data.startswith('PRIVMSG ')
-    signal_data = signal_data[len('PRIVMSG '):]
-    # get the place to which the user sent this message
-    dest, signal_data = signal_data.split(' ', 1)
+    m = PRIVMSG_RE.match(signal_data)
+    if m is None:
+        return w.WEECHAT_RC_OK
+    # The user that sent this message. It is only parsed into a UserStr once
+    # we know we'll need it, as most messages are thrown away.
+    source, dest, message = m.groups()
+    # get the place to which the user sent this message. Channel names and
+    # nicks are case insensitive, so normalize it to lowercase here once and
+    # let everything downstream (including modules) rely on that.
+    dest = dest.lower()
     # @#channel is a statusmsg to chanops in #channel, called 'opmod' by OFTC's
     # ircd (pre-solanum, aka "hybrid"ish). Remove the leading '@' if it exists
     # and remember that this is an opmod message
@@ -320,18 +516,11 @@ def privmsg_cb(data, signal, signal_data):
         is_opmod = True
     else:
         is_opmod = False
-    # trim leading ':'
-    assert signal_data.startswith(':')
-    signal_data = signal_data[1:]
     # the message that was sent
-    message = signal_data.strip()
+    message = message.strip()
     #######################
     # Determine what to do
     #######################
-    # If it is a user to ignore, ignore them
-    if user.nick in ignores():
-        # log('Ignore PRIVMSG from {} in {}', user.nick, dest)
-        return w.WEECHAT_RC_OK
     # Try handling the message as a command if it's from a master in a PM or in
     # the cmd_chan, or respond with the canned auto response if non-master and
     # PM. Non-masters in our cmd_chan should be ignored.
@@ -339,25 +528,26 @@ def privmsg_cb(data, signal, signal_data):
     # A master's PM may not be a command, so it is wrong to return early here.
     # At least, that's what I wrote before, but now we're doign it. Lol fuck
     # me.
-    if dest == my_nick() or dest == cmd_chan():
+    is_pm = dest == my_nick().lower()
+    if is_pm or dest == cmd_chan():
         # handle commands from masters
-        if user.nick in masters():
-            handle_command(user, dest, message)
+        if nick in masters_set():
+            handle_command(UserStr.intern(source), dest, message, is_pm)
         # it's a non-master, if a PM, then do canned response
-        elif dest == my_nick():
+        elif is_pm and nick is not None:
             notice(
-                user.nick, 'I am a bot operated by OFTC netops (mostly '
+                nick, 'I am a bot operated by OFTC netops (mostly '
                 'pastly) that blocks the "libera hamradio" spam before '
                 'channels see it. For more information, see {} or ask about '
                 'me in #oftc.', liberaham_url())
         return w.WEECHAT_RC_OK
-    # If it came in on something other than a moderated channel (e.g. cmd_chan
-    # or PM), ignore it
-    if dest not in mod_chans() + [my_nick(), cmd_chan()]:
+    # If it came in on something other than a moderated channel, ignore it.
+    # PMs and cmd_chan were handled above.
+    if dest not in mod_chans_set():
         return w.WEECHAT_RC_OK
+    user = UserStr.intern(source)
     # Tell our modules about this message
-    global MODULES
-    for mod in [m for m in MODULES if m.enabled()]:
+    for mod in ENABLED_MODULES:
         mod.privmsg_cb(user, dest, message, is_opmod)
     return w.WEECHAT_RC_OK
 
@@ -369,69 +559,99 @@ def notice_cb(data, signal, signal_data):
     #     ":dacia.oftc.net NOTICE pastly :Activating Cloak: example.com ->
     #         foo.oftc.net for foo"
     #     ":nick!user@host NOTICE #channel :some messge"
+    # Only modules do anything with NOTICEs, and most don't
+    if not NOTICE_MODULES:
+        return w.WEECHAT_RC_OK
+    # If it is a user to ignore, ignore them before doing any more work
+    nick = _source_nick(signal_data)
+    if nick in ignores_set():
+        dlog('Ignore NOTICE from {}', nick)
+        return w.WEECHAT_RC_OK
     #############
     # Parse data
     #############
-    # remove leading ':'
-    assert signal_data.startswith(':')
-    signal_data = signal_data[1:]
-    # parse out who sent this message. It could be a 'n!u@h' str, but it could
-    # also be an IRC server if we are an op
-    sender, signal_data = signal_data.split(' ', 1)
+    m = NOTICE_RE.match(signal_data)
+    if m is None:
+        return w.WEECHAT_RC_OK
+    sender, receiver, message = m.groups()
+    # who sent this message. It could be a 'n!u@h' str, but it could also be
+    # an IRC server if we are an op
     sender = sender.lower()
-    # trim cruft
-    assert signal_data.startswith('NOTICE ')
-    signal_data = signal_data[len('NOTICE '):]
-    # get the place to which the user sent this message (will always be us?)
-    receiver, signal_data = signal_data.split(' ', 1)
+    # the place to which the user sent this message (will always be us?)
     receiver = receiver.lower()
-    # trim leading ':'
-    assert signal_data.startswith(':')
-    signal_data = signal_data[1:]
     # the message that was sent
-    message = signal_data.strip()
+    message = message.strip()
     #######################
     # Determine what to do
     #######################
-    # If it is a user to ignore, ignore them.
-    if '!' in sender and sender[:sender.index('!')].lower() in ignores():
-        log('Ignore NOTICE from {}', sender)
-        return w.WEECHAT_RC_OK
-    global MODULES
-    for mod in [m for m in MODULES if m.enabled()]:
-        if mod.enabled():
-            mod.notice_cb(sender, receiver, message)
+    for mod in NOTICE_MODULES:
+        mod.notice_cb(sender, receiver, message)
     return w.WEECHAT_RC_OK
 
 
+def _hook_server_signals():
+    ''' Hook the IRC signals we care about, only for our configured server,
+    replacing any hooks we already had. Hooking them for all servers would
+    have weechat call into us for every line from every network it is on. '''
+    global SERVER_SIGNAL_HOOKS
+    for hook in SERVER_SIGNAL_HOOKS:
+        w.unhook(hook)
+    SERVER_SIGNAL_HOOKS = [
+        w.hook_signal(serv() + ',irc_raw_in2_' + irc_cmd, cb, '')
+        for irc_cmd, cb in [
+            ('JOIN', 'join_cb'),
+            ('PART', 'part_cb'),
+            ('PRIVMSG', 'privmsg_cb'),
+            ('NOTICE', 'notice_cb'),
+            ('NICK', 'nick_cb'),
+        ]]
+
+
+def _refresh_enabled_modules():
+    ''' Recompute :data:`ENABLED_MODULES` from the modules' options,
+    importing and constructing any enabled module that hasn't been yet.
+    Modules that are never enabled are never even imported. '''
+    global ENABLED_MODULES
+    global NOTICE_MODULES
+    have = {m.NAME for m in MODULES}
+    for name, cls_name in MODULE_CLASSES.items():
+        if name in have:
+            continue
+        if not w.config_string_to_boolean(CONF[name + '_enabled']):
+            continue
+        # Only resolve the class now, once every module is fully loaded
+        cls = getattr(importlib.import_module('tmb_mod.' + name), cls_name)
+        MODULES.append(cls())
+    ENABLED_MODULES = tuple(m for m in MODULES if m.enabled())
+    NOTICE_MODULES = tuple(
+        m for m in ENABLED_MODULES
+        if type(m).notice_cb is not tmb_mod.Module.notice_cb)
+
+
 def config_cb(data, option, value):
     ''' Called whenever the user changes some script options '''
     # set the new value
-    prefix = 'plugins.var.python.' + SCRIPT_NAME + '.'
-    option = option[len(prefix):]
+    option = option[len(CONF_PREFIX):]
+    old_mod_chans = mod_chans_set()
     CONF[option] = value
-    # make sure we're in all the right chans for modding
-    for c in mod_chans():
-        join(c)
+    if option == 'serv':
+        _refresh_my_nick()
+        _hook_server_signals()
+    # make sure we're in all the right chans for modding. Only newly added
+    # ones can be missing, and only if this option was the one that changed.
+    if option == 'mod_chans':
+        join_many([c for c in mod_chans() if c not in old_mod_chans])
+    # likewise, a newly set log or cmd chan is the only one we may be missing
+    elif option == 'log_chan' and log_chan():
+        join(log_chan())
+    elif option == 'cmd_chan' and cmd_chan():
+        join(cmd_chan())
+    # a module may have been enabled or disabled
+    if option.endswith('_enabled'):
+        _refresh_enabled_modules()
     return w.WEECHAT_RC_OK
 
 
-def infolist_len(ilist):
-    ''' Takes an infolist that has a cursor already at the beginning. Count the
-    number of items in it. Return cursor to beginning. Return number of items
-    in infolist. '''
-    count = 0
-    while w.infolist_next(ilist):
-        # log('%s' % (w.infolist_fields(ilist),))
-        n = w.infolist_string(ilist, 'name')
-        h = w.infolist_string(ilist, 'host')
-        a = w.infolist_string(ilist, 'prefixes')
-        log('{n}@{h} "{a}"', n=n, h=h, a=a)
-        count += 1
-    w.infolist_reset_item_cursor(ilist)
-    return count
-
-
 if __name__ == '__main__':
     if not w.register(
             SCRIPT_NAME, SCRIPT_AUTHOR, SCRIPT_VERSION, SCRIPT_LICENSE,
@@ -449,34 +669,26 @@ if __name__ == '__main__':
             CONF[opt] = w.config_get_plugin(opt)
 
     # (re)init systems
-    cmd_q.initialize(int(CONF['msg_burst']), float(CONF['msg_rate'])/1000)
+    cmd_q.initialize(
+        int(CONF['msg_burst']), float(CONF['msg_rate'])/1000,
+        int(CONF['msg_max_queue']))
     # tmb_mod.faq.initialize()
     # tmb_mod.hello.initialize()
     chanserv.initialize()
     userlist.initialize()
 
-    # create modules
-    if not len(MODULES):
-        MODULES = [
-            tmb_mod.liberaham.LiberaHamModule(),
-        ]
-
-    for mod in [m for m in MODULES if m.enabled()]:
+    # create the enabled modules
+    _refresh_enabled_modules()
+    for mod in ENABLED_MODULES:
         mod.initialize()
 
+    # We may have been (re)loaded while already connected
+    _refresh_my_nick()
+
     w.hook_signal('irc_server_connected', 'connected_cb', '')
     w.hook_signal('irc_server_disconnected', 'connected_cb', '')
-    w.hook_signal('*,irc_raw_in2_JOIN', 'join_cb', '')
-    w.hook_signal('*,irc_raw_in2_PART', 'part_cb', '')
-    w.hook_signal('*,irc_raw_in2_PRIVMSG', 'privmsg_cb', '')
-    w.hook_signal('*,irc_raw_in2_NOTICE', 'notice_cb', '')
-    w.hook_config('plugins.var.python.' + SCRIPT_NAME + '.*', 'config_cb', '')
-
-    # count = 0
-    # ilist = w.infolist_get('irc_nick', '', '%s,%s' % (log_serv, log_chan))
-    # count = infolist_len(ilist)
-    # log('%d nicks' % (count,))
-    # w.infolist_free(ilist)
+    _hook_server_signals()
+    w.hook_config(CONF_PREFIX + '*', 'config_cb', '')
 
     s = '{} v{} (re)loaded'.format(SCRIPT_NAME, SCRIPT_VERSION)
     log(s)